@@ -3,8 +3,11 @@ from __future__ import annotations
 import sys
 from typing import Any
 
-from pattern_matching.pattern_engine import str2pattern
-from pattern_matching.withhacks import lookup_name
+from pattern_matching.pattern_engine import str2pattern, Pattern
+from pattern_matching.withhacks import name_resolver, frame_scopes
+
+_OWN_ATTRIBUTES = frozenset(('__value__', '__matched__', '__frame__', '__scopes__', '__vars__'))
+
 
 class match:
     """
@@ -12,30 +15,45 @@ class match:
     
     Does not inject variables into the containing frame (as `pattern_matching.injecting` does), but looks up name in the containing frame.
     """
+    # Set to False if the with-block never assigns to local variables that later cases use as values.
+    fresh_locals = True
+
     def __init__(self, value: Any):
         self.__value__ = value
         self.__matched__ = False
         self.__frame__ = None
+        self.__scopes__ = None
         self.__vars__ = None
 
     def __enter__(self):
         self.__frame__ = sys._getframe(1)
+        self.__scopes__ = frame_scopes(self.__frame__, self.fresh_locals)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        # The captures stay accessible afterwards, but the frame (and with it all its variables) doesn't need to
+        self.__frame__ = None
+        self.__scopes__ = None
         return False
 
     def __getattr__(self, item):
-        return self.__vars__[item]
+        if item in _OWN_ATTRIBUTES:  # See `no_magic._Match.__getattr__`
+            raise AttributeError(item)
+        try:
+            return self.__vars__[item]
+        except (KeyError, TypeError):
+            raise AttributeError(item) from None
         
-    def _get(self, name: str):
-        return lookup_name(self.__frame__, name)
-
-    def case(self, pattern):
-        assert isinstance(pattern, str)
-        pt, g = str2pattern(pattern)
-        assert g is None
-        var = pt.match(self.__value__, self._get)
+    def case(self, pattern: str | Pattern):
+        if self.__frame__ is None:  # Released (or not yet known) outside of the with-block, see `__exit__`
+            raise ValueError("case() is only valid inside `with match`")
+        if isinstance(pattern, str):
+            pt, g = str2pattern(pattern)
+            assert g is None
+        else:
+            assert isinstance(pattern, Pattern)
+            pt = pattern
+        var = pt.match(self.__value__, name_resolver(self.__frame__, self.__scopes__))
         if var is not None:
             self.__matched__ = True
             self.__vars__ = var
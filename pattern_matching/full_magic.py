@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import ast
+import os
 import sys
 from dataclasses import dataclass
 from inspect import getsource
 from typing import Any, Callable, Optional, Generic, TypeVar
 
 from pattern_matching.pattern_engine import Pattern, ast2pattern
-from pattern_matching.withhacks import WithHack
+from pattern_matching.withhacks import WithHack, name_resolver
 
 _matcher_cache: dict[tuple[str, int], _Matcher] = {}
 
@@ -24,19 +25,18 @@ class match(WithHack):
         try:
             m = _matcher_cache[fn, fl]
         except KeyError:
-            with open(fn, encoding="utf-8") as f:
-                c = f.read()
-            m = _matcher_cache[fn, fl] = _parse_match_stmt(c, fl)
+            m = _matcher_cache[fn, fl] = _parse_match_stmt(_get_with(fn, fl))
         def exe(vars, a):
             lcls = {}
-            r = eval(a, {**self.__frame__.f_globals, **vars}, lcls)
+            r = eval(a.code, {**self.__frame__.f_globals, **vars}, lcls)
             if r:
                 vars |= lcls
                 return r
             else:
                 return r
             
-        l, v = m.match(self.value, self._get_local, exe)
+        # All cases are tried right here, before any user code runs, so names can be resolved once for all of them
+        l, v = m.match(self.value, name_resolver(self.__frame__), exe)
         self._set_context_locals(v)
         if l is None:
             self._dont_execute()
@@ -67,21 +67,53 @@ class _Matcher(Generic[T, U]):
         return self.otherwise, {}
 
 
-def _get_with(a: ast.AST, with_start_line: int) -> ast.With:
-    for n in ast.walk(a):
-        if isinstance(n, ast.With):
-            if n.lineno == with_start_line:
-                return n
-    else:
-        raise ValueError
+class _Guard:
+    """A guard expression, only compiled once it is evaluated for the first time."""
+    __slots__ = ('expression', '_code')
+
+    def __init__(self, expression: ast.expr):
+        self.expression = expression
+        self._code = None
+
+    @property
+    def code(self):
+        if self._code is None:
+            self._code = compile(ast.Expression(self.expression), '<guard>', 'eval')
+        return self._code
+
+
+_with_cache: dict[str, tuple[float, dict[int, ast.With]]] = {}
+
+
+def _get_with(filename: str, with_start_line: int) -> ast.With:
+    """
+    Finds the `with` statement starting at the given line.
+
+    Each file is only parsed once (until it changes), no matter how many `with match` statements it contains.
+    """
+    mtime = os.stat(filename).st_mtime
+    try:
+        cached_mtime, withs = _with_cache[filename]
+    except KeyError:
+        cached_mtime = withs = None
+    if cached_mtime != mtime:
+        with open(filename, encoding="utf-8") as f:
+            full_ast = ast.parse(f.read())
+        withs = {}
+        for n in ast.walk(full_ast):
+            if isinstance(n, ast.With):
+                withs.setdefault(n.lineno, n)
+        _with_cache[filename] = mtime, withs
+    try:
+        return withs[with_start_line]
+    except KeyError:
+        raise ValueError(f"No with statement in {filename} at line {with_start_line}") from None
 
 
-def _parse_match_stmt(code: str, with_start_line: int) -> _Matcher:
-    full_ast = ast.parse(code)
-    w = _get_with(full_ast, with_start_line)
+def _parse_match_stmt(w: ast.With) -> _Matcher:
     assert len(w.items) == 1
     b = w.body
-    cases: list[tuple[Pattern, int, Any]] = []
+    cases: list[tuple[Pattern, int, Optional[_Guard]]] = []
     while len(b) == 1 and isinstance(b[0], ast.If):
         i, = b
         assert i.test.lineno != i.body[0].lineno
@@ -89,8 +121,7 @@ def _parse_match_stmt(code: str, with_start_line: int) -> _Matcher:
         if isinstance(a, ast.BoolOp):
             assert isinstance(a.op, ast.And)
             l,r = a.values
-            pat, guard = ast2pattern(l), r
-            guard = compile(ast.Expression(guard), '<guard>', 'eval')
+            pat, guard = ast2pattern(l), _Guard(r)
         else:
             pat, guard = ast2pattern(a), None
         cases.append((pat, i.body[0].lineno, guard))
@@ -3,35 +3,40 @@ from __future__ import annotations
 import sys
 from typing import Any
 
-from pattern_matching.pattern_engine import str2pattern
-from pattern_matching.withhacks import WithHack, lookup_name
+from pattern_matching.pattern_engine import str2pattern, Pattern
+from pattern_matching.withhacks import WithHack, lookup_name, name_resolver, frame_scopes
 
 
 class match(WithHack):
     """
     A fully magic match statement that automatically injects variables into the frame.
     """
+    # Set to False if the with-block never assigns to local variables that later cases use as values.
+    fresh_locals = True
+
     def __init__(self, value: Any):
         super(match, self).__init__()
         self.value = value
 
     def __enter__(self):
         super(match, self).__enter__()
+        self.__scopes__ = frame_scopes(self.__frame__, self.fresh_locals)
         self._set_context_locals({'__match_obj__': self})
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._set_context_locals({'__match_obj__': None})
+        self.__scopes__ = None
         return super(match, self).__exit__(exc_type, exc_val, exc_tb)
 
-    def _get(self, name: str):
-        return lookup_name(self.__frame__, name)
-
-    def case(self, pattern):
-        assert isinstance(pattern, str)
-        pt, g = str2pattern(pattern)
-        assert g is None
-        var = pt.match(self.value, self._get)
+    def case(self, pattern: str | Pattern):
+        if isinstance(pattern, str):
+            pt, g = str2pattern(pattern)
+            assert g is None
+        else:
+            assert isinstance(pattern, Pattern)
+            pt = pattern
+        var = pt.match(self.value, name_resolver(self.__frame__, self.__scopes__))
         if var is not None:
             self._set_context_locals(var)
             return True
@@ -3,14 +3,18 @@ Provides facilities to deal with `__match_args__` as defined in PEP-634.
 Since we can't modify the stdlib to correctly report `__match_args__` for those classes (especially dataclass/namedtuple),
 we also have extra work that is not described in the PEP that allows us to use those classes.
 
-The main interface used by the rest of `pattern_matching` is match_args_and_kwargs.
+The main interface used by the rest of `pattern_matching` is `attribute_getters`
+(`match_args_and_kwargs` applies them to a value, implementing the whole algorithm in one go).
 
 If you want to add additional handlers for third party modules, or even the stdlib, you can call `register`/`regsiter_special`
 """
 from __future__ import annotations
 
 from dataclasses import is_dataclass, fields
+from operator import attrgetter
+from itertools import chain
 from typing import Any, Tuple, Optional, Callable, TypeVar
+from weakref import WeakKeyDictionary
 
 special_attributes = {
     "<self>": lambda x: x
@@ -30,8 +34,16 @@ def module_qualname(t: type) -> str:
 known_cases: dict[str, tuple[str,...]] = { # This helps to avoid importing modules that aren't actually used
 }
 
+# Weak, so that classes created on the fly (e.g. `namedtuple`s) aren't kept alive by having been matched against.
+# Lookups only happen when `attribute_getters` fills its own cache, so the slower WeakKeyDictionary doesn't matter.
+_match_args_cache: WeakKeyDictionary[type, tuple[str, ...]] = WeakKeyDictionary()
+# For `attribute_getters`: per type, the getters for each `(n_args, keywords)` shape of class pattern. Weak as well.
+_attribute_getters_cache: WeakKeyDictionary[type, dict[tuple, tuple[Callable, ...]]] = WeakKeyDictionary()
+
 def register(module_qualname: str, match_args: tuple[str, ...]):
     known_cases[module_qualname] = match_args
+    _match_args_cache.clear()
+    _attribute_getters_cache.clear()
 
 def register_special(checker: Callable[[Any], bool], match_args_gen: Callable[[Any], tuple[str, ...]]):
     """
@@ -40,8 +52,20 @@ def register_special(checker: Callable[[Any], bool], match_args_gen: Callable[[A
      nor `match_args_gen` have access to the instance
     """
     special_handlers.append((checker, match_args_gen))
+    _match_args_cache.clear()
+    _attribute_getters_cache.clear()
 
 def __match_args__(t):
+    """
+    The match args for `t`. Figuring them out walks through all the registries, so the result is cached per type.
+    (This assumes that a class doesn't change its `__match_args__` after it has been used in a pattern)
+    """
+    ma = _match_args_cache.get(t)
+    if ma is None:
+        ma = _match_args_cache[t] = _compute_match_args(t)
+    return ma
+
+def _compute_match_args(t):
     try:
         return t.__match_args__
     except AttributeError:
@@ -63,42 +87,57 @@ def match_args_and_kwargs(t, val: Any, args: Tuple[T, ...], kwargs: tuple[tuple[
     """
     if len(args) == 0 and len(kwargs) == 0:
         return ()
+    getters = attribute_getters(t, len(args), tuple(n for n, _ in kwargs))
+    try:
+        values = [g(val) for g in getters]
+    except AttributeError:
+        return None
+    return tuple(zip(chain(args, (k for _, k in kwargs)), values))
+
+
+def attribute_names(t, n_args: int, keywords: tuple[str, ...]) -> tuple[str, ...]:
+    """
+    The names of the attributes (or special attributes) that a class pattern for `t` with `n_args` positional
+    arguments and the given keywords looks at, in order. Only depends on the shape of the pattern.
+    """
     ma = __match_args__(t)
     assert isinstance(ma, (list, tuple)), ma
-    if len(ma) < len(args):
-        raise TypeError(f"Too many positional arguments for {type(val)} (expected at most {len(ma)}, got {len(args)})")
-    taken = {n for n, _ in kwargs}
-    named_args = []
-    for n, a in zip(ma, args):
+    if len(ma) < n_args:
+        raise TypeError(f"Too many positional arguments for {t} (expected at most {len(ma)}, got {n_args})")
+    taken = set(keywords)
+    for n in ma[:n_args]:
         if n in taken:
             raise TypeError(f"Duplicate keyword: {n}")
         taken.add(n)
-        named_args.append((n, a))
-    out = []
-    for n, k in (named_args + list(kwargs)):
-        if n in special_attributes:
-            v = special_attributes[n](val)
-        else:
-            try:
-                v = getattr(val, n)
-            except AttributeError:
-                return None
-        out.append((k, v))
-    return out
+    return (*ma[:n_args], *keywords)
 
 
+def attribute_getters(t, n_args: int, keywords: tuple[str, ...]) -> tuple[Callable[[Any], Any], ...]:
+    """
+    Like `attribute_names`, but returns a function for each attribute that gets it from an instance of `t`.
+    These raise `AttributeError` if the attribute is missing. Plain attributes use `operator.attrgetter`,
+    so no python code runs per attribute, and special attributes are resolved ahead of time.
+    This is called for every match of a class pattern, so the result is cached per type and shape.
+    """
+    try:
+        return _attribute_getters_cache[t][n_args, keywords]
+    except KeyError:
+        pass
+    getters = tuple(special_attributes[n] if n in special_attributes else attrgetter(n)
+                    for n in attribute_names(t, n_args, keywords))
+    _attribute_getters_cache.setdefault(t, {})[n_args, keywords] = getters
+    return getters
 
 
 def _match_args_from_dataclass(t):
     return tuple(f.name for f in fields(t) if f.init)
 
 def _is_namedtuple(obj):
+    # Only called once per type thanks to `_match_args_cache`.
+    # Uses `issubclass` so that subclasses of namedtuples are recognized as well.
     cls = obj if isinstance(obj, type) else type(obj)
-    bases = cls.__bases__
-    if bases != (tuple,): return False
-    fields = getattr(obj, '_fields', None)
-    if not isinstance(fields, tuple): return False
-    return all(type(n) == str for n in fields)
+    fields = getattr(cls, '_fields', None)
+    return isinstance(fields, tuple) and issubclass(cls, tuple) and all(isinstance(n, str) for n in fields)
 
 def _match_args_from_namedtuple(t):
     return t._fields
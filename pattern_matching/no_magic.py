@@ -1,19 +1,32 @@
 from __future__ import annotations
 from typing import Any
 
-from pattern_matching.pattern_engine import str2pattern
+from pattern_matching.pattern_engine import str2pattern, Pattern
+
+
+_OWN_ATTRIBUTES = frozenset(('__matcher__', '__value__', '__vars__', '__memo__'))
 
 
 class _Match:
-    def __init__(self, matcher: Matcher, value: Any):
+    def __init__(self, matcher: Matcher, value: Any, memo: bool = False):
         self.__matcher__ = matcher
         self.__value__ = value
         self.__vars__ = None
+        # Keyed by the identity of the pattern: parsed patterns are hash-consed, so equal patterns from different strings
+        # (e.g. with other guards) are the same object anyway, while `==` would conflate e.g. `1`, `1.0` and `True`
+        self.__memo__ = {} if memo else None
 
     def __getattr__(self, item):
-        return self.__vars__[item]
+        # Only reached when normal lookup failed, so this never slows down access to our own attributes.
+        # Protocol probes like `copy`'s `__deepcopy__` also land here and need an AttributeError to fall back.
+        if item in _OWN_ATTRIBUTES:  # Not set yet, e.g. while `copy` reconstructs the instance
+            raise AttributeError(item)
+        try:
+            return self.__vars__[item]
+        except (KeyError, TypeError):
+            raise AttributeError(item) from None
 
-    def __matmul__(self, other: str):
+    def __matmul__(self, other: str | Pattern):
         return self.case(other)
 
     def __enter__(self):
@@ -22,10 +35,13 @@ class _Match:
     def __exit__(self, exc_type, exc_val, exc_tb):
         return False
 
-    def case(self, pattern: str):
-        assert isinstance(pattern, str)
-        pt, g = str2pattern(pattern)
-        var = pt.match(self.__value__, self.__matcher__._get)
+    def case(self, pattern: str | Pattern):
+        if isinstance(pattern, str):
+            pt, g = str2pattern(pattern)
+        else:  # Already parsed ahead of time, e.g. hoisted out of a loop
+            assert isinstance(pattern, Pattern)
+            pt, g = pattern, None
+        var = self._match_pattern(pt)
         if var is not None:
             if g is not None:
                 if not eval(g, self.__matcher__.__names__, var):
@@ -35,7 +51,19 @@ class _Match:
         else:
             return False
 
-    def __call__(self, pattern: str):
+    def _match_pattern(self, pt):
+        memo = self.__memo__
+        if memo is None:
+            return pt.match(self.__value__, self.__matcher__._get)
+        try:
+            _, var = memo[id(pt)]
+        except KeyError:
+            var = pt.match(self.__value__, self.__matcher__._get)
+            memo[id(pt)] = pt, var  # Keeps `pt` alive, so that its id can't be reused for another pattern
+        # The result is handed out as the guard's locals and as our `__vars__`, so it must not be shared
+        return None if var is None else dict(var)
+
+    def __call__(self, pattern: str | Pattern):
         return self.case(pattern)
 
 
@@ -60,5 +88,12 @@ class Matcher:
         except KeyError:
             raise NameError(name)
 
-    def __call__(self, value: Any):
-        return _Match(self, value)
\ No newline at end of file
+    def __call__(self, value: Any, memo: bool = False):
+        """
+        Starts matching against `value`.
+
+        With `memo=True`, the result of each distinct pattern is computed only once for this value,
+        which helps when the same (expensive) pattern is tried repeatedly, e.g. with different guards.
+        The value must not be mutated while matching against it.
+        """
+        return _Match(self, value, memo)
\ No newline at end of file
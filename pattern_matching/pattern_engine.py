@@ -1,76 +1,325 @@
 from __future__ import annotations
 
 import ast
+import atexit
+import os
+import pickle
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, fields, InitVar, is_dataclass
 from functools import lru_cache
-from itertools import zip_longest, takewhile
-from typing import Callable, Any, Iterable, Sequence, Optional, Mapping, Generic, TypeVar
+from weakref import WeakValueDictionary
+from typing import Callable, Any, Iterable, Sequence, Optional, Dict, Mapping, Generic, TypeVar, TYPE_CHECKING
 
-from lark import Lark, Transformer, v_args, Token
+if TYPE_CHECKING:
+    from lark import Lark, Token
 
-from pattern_matching.match_args_data import match_args_and_kwargs
+from pattern_matching.match_args_data import attribute_getters, builtin_match_args
 
 
-@dataclass(frozen=True)
-class Pattern(ABC):
-    @abstractmethod
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        raise NotImplementedError
+MatchFunction = Callable[[Any, Callable[[str], Any]], Optional[Dict[str, Any]]]
+
 
+class _TypeCheckCache(dict):
+    """
+    Maps types to whether they are subclasses of `abc`, filled in on first lookup.
+
+    `isinstance` against the `collections.abc` classes is several times slower than a dict lookup.
+    (This assumes that a type isn't registered with `abc` after it has been matched against)
+    It is looked up for every sequence and mapping pattern, where a WeakKeyDictionary would be several times slower,
+    so it is emptied once it holds `maxsize` types instead, to not keep an unbounded number of classes alive.
+    """
+
+    def __init__(self, abc: type, maxsize: int = 1024):
+        super().__init__()
+        self.abc = abc
+        self.maxsize = maxsize
+
+    def __missing__(self, t: type) -> bool:
+        if len(self) >= self.maxsize:
+            self.clear()
+        r = self[t] = issubclass(t, self.abc)
+        return r
 
-@dataclass(frozen=True)
+
+_HASH_CONSISTENT_TYPES = frozenset((str, bytes, int, float, bool, type(None)))
+
+_is_sequence_type = _TypeCheckCache(Sequence)
+_is_mapping_type = _TypeCheckCache(Mapping)
+
+
+class _CodeGen:
+    """
+    Collects the source code of a generated match function, see `Pattern.compile`.
+
+    Objects the code needs are passed in as globals of the generated function, named by `const`.
+    Captured values stay in local variables until the end, where the result is built by a single dict display.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.captures = []
+        self.namespace = {'_missing': _missing_marker,
+                          '_is_sequence_type': _is_sequence_type, '_is_mapping_type': _is_mapping_type,
+                          '_hash_consistent_types': _HASH_CONSISTENT_TYPES,
+                          '_attribute_getters': attribute_getters, '_builtin_match_args': builtin_match_args}
+        self._counter = 0
+        self._names = {}
+
+    def var(self) -> str:
+        self._counter += 1
+        return f"_v{self._counter}"
+
+    def lookup(self, name: str, conditional: bool = False) -> str:
+        """
+        Returns an expression for `get(name)`. The code is straight-line (it only ever returns early),
+        so a name that has been looked up before is still available in its local variable.
+        If the expression is `conditional`ly evaluated, it can't introduce such a variable itself.
+        """
+        if name in self._names:
+            return self._names[name]
+        if conditional:
+            return f"get({name!r})"
+        var = self._names[name] = self.var()
+        self.emit(f"{var} = get({name!r})")
+        return var
+
+    def const(self, value: Any) -> str:
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def emit(self, line: str):
+        self.lines.append(f"    {line}")
+
+    def capture(self, name: str, var: str):
+        """Binds `name` to the value of the local variable `var`, which must not be reassigned afterwards."""
+        self.captures.append(f"{name!r}: {var}")
+
+    def capture_all(self, var: str):
+        """Binds everything in the dict `var`"""
+        self.captures.append(f"**{var}")
+
+    def build(self, name: str, params: str = "value, get") -> MatchFunction:
+        result = f"    return {{{', '.join(self.captures)}}}"
+        source = "\n".join((f"def match({params}):", *self.lines, result, ""))
+        exec(compile(source, f"<pattern {name}>", 'exec'), self.namespace)
+        return self.namespace['match']
+
+
+@dataclass(frozen=True, eq=False)
+class Pattern(ABC):
+    # Every subclass declares its fields as slots: patterns are immutable and created in large numbers
+    __slots__ = ('_matcher', '_hash', '__weakref__')
+
+    def compile(self) -> MatchFunction:
+        """
+        Builds a function `(value, get) -> Optional[dict]` that implements this pattern.
+
+        The whole pattern tree is generated as the straight-line source code of a single function via `emit`,
+        with names and constants resolved ahead of time, so matching doesn't walk the tree or call per node.
+        """
+        gen = _CodeGen()
+        self.emit(gen, 'value')
+        return gen.build(type(self).__name__)
+
+    def emit(self, gen: _CodeGen, value: str):
+        """
+        Emits code that matches the local variable named `value`, registers the captures with
+        `gen.capture` and does `return None` if it doesn't match.
+
+        The default calls the compiled matcher of this node, for patterns that can't be inlined.
+        """
+        r = gen.var()
+        gen.emit(f"{r} = {gen.const(self.matcher)}({value}, get)")
+        gen.emit(f"if {r} is None: return None")
+        gen.capture_all(r)
+
+    @property
+    def matcher(self) -> MatchFunction:
+        """The compiled version of this pattern. Built on first use, since most sub patterns are only ever inlined"""
+        try:
+            return self._matcher
+        except AttributeError:
+            m = self.compile()
+            object.__setattr__(self, '_matcher', m)
+            return m
+
+    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
+        try:
+            m = self._matcher
+        except AttributeError:
+            m = self.matcher
+        return m(value, get)
+
+    def match_many(self, values: Iterable[Any], get: Callable[[str], Any]) -> list[Optional[dict[str, Any]]]:
+        """
+        Same as `[self.match(v, get) for v in values]`, for matching one pattern against lots of values.
+        `get` is shared by all of them, so wrap it in a cache (like `withhacks.name_resolver`) if it is expensive.
+        """
+        m = self.matcher
+        return [m(v, get) for v in values]
+
+    def _fields(self) -> tuple:
+        return tuple(getattr(self, f.name) for f in fields(self))
+
+    # Equality is structural (so that e.g. the memo in `no_magic` is shared between equal patterns), but implemented
+    # once here instead of by `dataclass`: identity is checked first, since parsed patterns are cached and usually
+    # the same object, and the hash of the immutable tree is only calculated once.
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            h = hash((type(self), self._fields()))
+            object.__setattr__(self, '_hash', h)
+            return h
+
+    def __reduce__(self):
+        # The default for slotted classes restores state with setattr, which frozen dataclasses forbid.
+        # Going through `__init__` instead also skips the compiled `_matcher`.
+        return type(self), tuple(getattr(self, f.name) for f in fields(self))
+
+
+@dataclass(frozen=True, eq=False)
 class PtCaptureAs(Pattern):
+    __slots__ = ('base', 'name')
     base: Pattern
     name: str
 
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        r = self.base.match(value, get)
-        if r is not None:
-            r[self.name] = value
-        return r
+    def emit(self, gen: _CodeGen, value: str):
+        self.base.emit(gen, value)
+        gen.capture(self.name, value)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class PtCapture(Pattern):
+    __slots__ = ('name',)
     name: str
 
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        return {self.name: value}
+    def emit(self, gen: _CodeGen, value: str):
+        gen.capture(self.name, value)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class PtOr(Pattern):
+    __slots__ = ('options',)
     options: tuple[Pattern, ...]
 
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        for o in self.options:
-            r = o.match(value, get)
-            if r is not None:
-                return r
+    def emit(self, gen: _CodeGen, value: str):
+        if not all(isinstance(o, PtConstant) for o in self.options):
+            cls = self._shared_class()
+            if cls is None:
+                return super().emit(gen, value)
+            # For `Foo(1, x) | Foo(2, x)`, a value that isn't a `Foo` can be rejected without trying every option.
+            # The options are still called one after the other, each with its own result, but they are passed
+            # the class instead of resolving and checking it again.
+            t = self.options[0].emit_class(gen)
+            gen.emit(f"if not isinstance({value}, {t}): return None")
+            r = gen.var()
+            first, *rest = (gen.const(self._attributes_matcher(o)) for o in self.options)
+            gen.emit(f"{r} = {first}({value}, get, {t})")
+            for o in rest:
+                gen.emit(f"if {r} is None: {r} = {o}({value}, get, {t})")
+            gen.emit(f"if {r} is None: return None")
+            return gen.capture_all(r)
+        # Options like `1 | 2 | None` bind nothing, so there is nothing to roll back and they can be inlined
+        if all(isinstance(o, PtLiteral) for o in self.options):
+            # `in` compares with `==` just like `PtLiteral`, but in C
+            values = tuple(o.value for o in self.options)
+            if len(values) > 4 and all(type(v) in _HASH_CONSISTENT_TYPES for v in values):
+                # For these types, equal values have equal hashes, so a set lookup gives the same answer
+                gen.emit(f"if not ({value} in {gen.const(frozenset(values))} if type({value}) in _hash_consistent_types"
+                         f" else {value} in {gen.const(values)}): return None")
+            else:
+                gen.emit(f"if {value} not in {gen.const(values)}: return None")
         else:
+            options = (f'{o.emit_value(gen, conditional=True)} == {value}' for o in self.options)
+            gen.emit(f"if not ({' or '.join(options)}): return None")
+
+    @staticmethod
+    def _attributes_matcher(o: PtClass) -> Callable[[Any, Callable[[str], Any], type], Optional[Dict[str, Any]]]:
+        """Like `o.matcher`, but for values that are already known to be instances of the class passed in"""
+        gen = _CodeGen()
+        o.emit_attributes(gen, 'value', 'cls')
+        return gen.build(type(o).__name__, "value, get, cls")
+
+    def _shared_class(self) -> Optional[PtConstant]:
+        """The class, if every option is a class pattern for the same one"""
+        if all(isinstance(o, PtClass) for o in self.options) and len({o.cls for o in self.options}) == 1:
+            return self.options[0].cls
+        return None
+
+    def compile(self) -> MatchFunction:
+        if all(isinstance(o, PtConstant) for o in self.options) or self._shared_class() is not None:
+            return super().compile()
+        # Options that bind names could leave behind partial captures when they fail,
+        # so each one gets its own result and they are called instead of inlined
+        options = tuple(o.matcher for o in self.options)
+        lengths = {len(o.elements) for o in self.options if isinstance(o, PtFixedSequence)}
+        if len(lengths) <= 1:
+            def match(value, get):
+                for o in options:
+                    r = o(value, get)
+                    if r is not None:
+                        return r
+                return None
+            return match
+
+        # For options like `["look"] | ["go", direction]`, the length of a sequence decides which of the
+        # fixed sequence options can match at all. The others are still tried in their original order.
+        others = tuple(o.matcher for o in self.options if not isinstance(o, PtFixedSequence))
+        by_length = {n: tuple(o.matcher for o in self.options
+                              if not isinstance(o, PtFixedSequence) or len(o.elements) == n)
+                     for n in lengths}
+
+        def match(value, get):
+            if _is_sequence_type[type(value)]:
+                candidates = by_length.get(len(value), others)
+            else:
+                candidates = others
+            for o in candidates:
+                r = o(value, get)
+                if r is not None:
+                    return r
             return None
+        return match
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class PtConstant(Pattern, ABC):
+    __slots__ = ()
     
     @abstractmethod
     def calc_value(self, get: Callable[[str], Any]) -> Any:
         raise NotImplementedError
-    
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        return {} if self.calc_value(get) == value else None
 
+    def emit_value(self, gen: _CodeGen, conditional: bool = False) -> str:
+        """Returns an expression that calculates the value of this constant, see `_CodeGen.lookup`."""
+        return f"{gen.const(self.calc_value)}(get)"
 
-@dataclass(frozen=True)
+    def emit(self, gen: _CodeGen, value: str):
+        gen.emit(f"if not ({self.emit_value(gen)} == {value}): return None")
+
+
+@dataclass(frozen=True, eq=False)
 class PtLiteral(PtConstant):
+    __slots__ = ('value',)
     value: Any
     
     def calc_value(self, get: Callable[[str], Any]) -> Any:
         return self.value
 
+    def emit_value(self, gen: _CodeGen, conditional: bool = False) -> str:
+        return gen.const(self.value)
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class PtValue(PtConstant):
+    __slots__ = ('attributes',)
     attributes: tuple[str, ...]
     
     def calc_value(self, get: Callable[[str], Any]) -> Any:
@@ -79,106 +328,167 @@ class PtValue(PtConstant):
             value = getattr(value, a)
         return value
 
-@dataclass(frozen=True)
+    def emit_value(self, gen: _CodeGen, conditional: bool = False) -> str:
+        name, *attributes = self.attributes
+        return ''.join((gen.lookup(name, conditional), *(f".{a}" for a in attributes)))
+
+@dataclass(frozen=True, eq=False)
 class PtClass(Pattern):
+    __slots__ = ('cls', 'args', 'kwargs')
     cls: PtValue
     args: tuple[Pattern, ...]
     kwargs: tuple[tuple[str, Pattern], ...]
     
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        t = self.cls.calc_value(get)
-        assert isinstance(t, type), t
-        if not isinstance(value, t):
-            return None
-        pairs = match_args_and_kwargs(t, value, self.args, self.kwargs)
-        if pairs is None:
-            return None
-        out = {}
-        for pat, val in pairs:
-            pat: Pattern
-            res = pat.match(val, get)
-            if res is None:
-                return None
-            out.update(res)
-        return out
-
-
-def _match_all(pts: tuple[Pattern, ...], value: Any, get) -> Optional[dict[str, Any]]:
-    out = {}
-    for e, v in zip_longest(pts, value):
-        cvar = e.match(v, get)
-        if cvar is None:
-            return None
+    def emit(self, gen: _CodeGen, value: str):
+        t = self.emit_class(gen)
+        gen.emit(f"if not isinstance({value}, {t}): return None")
+        self.emit_attributes(gen, value, t)
+
+    def emit_class(self, gen: _CodeGen) -> str:
+        """Emits code that resolves the class and checks that it is one. Returns the variable holding it."""
+        t = self.cls.emit_value(gen)
+        if not t.isidentifier():  # A dotted name, which we don't want to evaluate more than once
+            t, expr = gen.var(), t
+            gen.emit(f"{t} = {expr}")
+        gen.emit(f"assert isinstance({t}, type), {t}")
+        return t
+
+    def emit_attributes(self, gen: _CodeGen, value: str, t: str):
+        """The rest of `emit`, for a `value` that is already known to be an instance of the class in `t`"""
+        if not self.args and not self.kwargs:  # `Cls()` is just an isinstance check, no need to look at the match args
+            return
+        # The attribute values come back in the order of the sub patterns, so they can be unpacked directly
+        patterns = (*self.args, *(p for _, p in self.kwargs))
+        keywords = gen.const(tuple(n for n, _ in self.kwargs))
+        getters = gen.var()
+        values = [gen.var() for _ in patterns]
+        if len(self.args) == 1 and not self.kwargs:
+            # Patterns like `int(x)` or `str(s)` for builtins, which match the value itself
+            gen.emit(f"if {t} in _builtin_match_args:")
+            gen.emit(f"    {values[0]} = {value}")
+            gen.emit("else:")
+            indent = "    "
         else:
-            out.update(cvar)
-    return out
+            indent = ""
+        gen.emit(f"{indent}{getters} = _attribute_getters({t}, {len(self.args)}, {keywords})")
+        gen.emit(f"{indent}try:")
+        for i, v in enumerate(values):
+            gen.emit(f"{indent}    {v} = {getters}[{i}]({value})")
+        gen.emit(f"{indent}except AttributeError: return None")
+        for p, v in zip(patterns, values):
+            p.emit(gen, v)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class PtFixedSequence(Pattern):
+    __slots__ = ('elements',)
     elements: tuple[Pattern, ...]
 
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        if not isinstance(value, Sequence):
-            return None
-        if len(value) != len(self.elements):
-            return None
-        return _match_all(self.elements, value, get)
+    def emit(self, gen: _CodeGen, value: str):
+        gen.emit(f"if not _is_sequence_type[type({value})] or len({value}) != {len(self.elements)}: return None")
+        if not self.elements:
+            return
+        values = [gen.var() for _ in self.elements]
+        gen.emit(f"{''.join(f'{v}, ' for v in values)}= {value}")
+        for p, v in zip(self.elements, values):
+            p.emit(gen, v)
 
 _missing_marker = object()
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class PtMapping(Pattern):
+    __slots__ = ('elements', 'star')
     elements: tuple[tuple[PtConstant, Pattern], ...]
-    star: str = None
+    star: Optional[str]
 
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        if not isinstance(value, Mapping):
-            return None
-        out = {}
-        used = set()
+    def emit(self, gen: _CodeGen, value: str):
+        gen.emit(f"if not _is_mapping_type[type({value})]: return None")
+        keys = []
         for kp, vp in self.elements:
-            key = kp.calc_value(get)
-            if key not in value:
-                return None
-            val = value.get(key, _missing_marker)
-            if val is _missing_marker:
-                return None
-            cvar = vp.match(val, get)
-            if cvar is None:
-                return None
-            out.update(cvar)
-            used.add(kp)
+            if isinstance(kp, PtLiteral):  # Known at compile time, no need to recalculate it for every match
+                key = gen.const(kp.value)
+            else:
+                key = gen.var()
+                gen.emit(f"{key} = {kp.emit_value(gen)}")
+            val = gen.var()
+            gen.emit(f"{val} = {value}.get({key}, _missing)")
+            gen.emit(f"if {val} is _missing: return None")
+            vp.emit(gen, val)
+            keys.append(key)
         if self.star is not None:
-            out[self.star] = {k: v for k, v in value.items() if k not in used}
-        return out
+            # Copying in C and removing the few used keys beats filtering every item in python
+            rest = gen.var()
+            gen.emit(f"{rest} = dict({value})")
+            for key in keys:
+                gen.emit(f"{rest}.pop({key}, None)")  # The same key might be used twice
+            gen.capture(self.star, rest)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class PtVariableSequence(Pattern):
+    __slots__ = ('pre', 'star', 'post')
     pre: tuple[Pattern, ...]
     star: str
     post: tuple[Pattern, ...]
 
-    def match(self, value: Any, get: Callable[[str], Any]) -> Optional[dict[str, Any]]:
-        if not isinstance(value, Sequence):
-            return None
-        if len(value) < len(self.pre) + len(self.post):
-            return None
-        pre_val = value[:len(self.pre)]
-        post_val = value[len(value) - len(self.post):]  # -len(self.post) is not enough, since `-0` is equivalent to `0`
-        star_val = value[len(self.pre):len(value) - len(self.post)]
-        pre_out = _match_all(self.pre, pre_val, get)
-        if pre_out is None:
-            return None
-        post_out = _match_all(self.post, post_val, get)
-        if post_out is None:
-            return None
+    def emit(self, gen: _CodeGen, value: str):
+        n_pre, n_post = len(self.pre), len(self.post)
+        gen.emit(f"if not _is_sequence_type[type({value})] or len({value}) < {n_pre + n_post}: return None")
+        for i, p in enumerate(self.pre):
+            v = gen.var()
+            gen.emit(f"{v} = {value}[{i}]")
+            p.emit(gen, v)
+        # `value[n_pre:-n_post]` is not enough, since `-0` is equivalent to `0`
+        star = gen.var()
+        gen.emit(f"{star} = {value}[{n_pre}:len({value}) - {n_post}]")
+        gen.capture(self.star, star)
+        for i, p in enumerate(self.post):
+            v = gen.var()
+            gen.emit(f"{v} = {value}[{i - n_post}]")
+            p.emit(gen, v)
+
+
+# Leaf patterns are immutable and recur across many pattern strings, so they are shared instead of rebuilt.
+# `typed=True` keeps literals like `1`, `1.0` and `True` apart, since they compare equal.
+@lru_cache(maxsize=1024, typed=True)
+def _literal(value: Any) -> PtLiteral:
+    return PtLiteral(value)
+
+
+@lru_cache(maxsize=1024)
+def _capture(name: str) -> PtCapture:
+    return PtCapture(name)
 
-        return {**pre_out,self.star: star_val, **post_out}
 
+@lru_cache(maxsize=1024)
+def _value(attributes: tuple[str, ...]) -> PtValue:
+    return PtValue(attributes)
 
-pattern_lark_parser = Lark(r"""
+
+_NONE, _TRUE, _FALSE = _literal(None), _literal(True), _literal(False)
+
+
+# The same goes for the inner nodes: structurally identical patterns (e.g. from strings that only differ in
+# whitespace or the guard) become the same object, so they share their compiled matcher.
+_interned: WeakValueDictionary[tuple, Pattern] = WeakValueDictionary()
+
+
+def _identity_key(value: Any) -> Any:
+    # Children are already interned, so they are compared by identity. This also keeps `1` and `True` apart.
+    if isinstance(value, Pattern):
+        return id(value)
+    elif type(value) is tuple:
+        return tuple(_identity_key(v) for v in value)
+    else:
+        return type(value), value
+
+
+def _intern(pattern: Pattern) -> Pattern:
+    key = (type(pattern), *(_identity_key(v) for v in pattern._fields()))
+    return _interned.setdefault(key, pattern)
+
+
+_PATTERN_GRAMMAR = r"""
 ?start: pat ["if" /.+/]
 ?pat: seq_item "," _sequence -> sequence | as_pattern
 ?as_pattern: or_pattern ("as" NAME)?
@@ -223,31 +533,85 @@ STRING: /"([^\\\\\n"]|\\\\.)*"/s
 NAME: /[a-zA-Z_][a-zA-Z_0-9]*/
 %import common.NUMBER
 %ignore " "+
-""", start='start', parser='lalr', maybe_placeholders=True)
+"""
 
+_pattern_lark_parser: Optional[Lark] = None
 
-@v_args(inline=True)
-class Lark2Pattern(Transformer):
-    def __default__(self, data, children, meta):
-        raise NotImplementedError((data, children, meta))
+
+def get_pattern_lark_parser() -> Lark:
+    """
+    Returns the parser for pattern strings, building it on first use.
+
+    Importing lark and building the parser is the bulk of our import time,
+    and it isn't needed at all by `full_magic`, which works on the python ast.
+    """
+    global _pattern_lark_parser
+    if _pattern_lark_parser is None:
+        try:
+            import lark_cython
+        except ImportError:
+            plugins = None
+        else:
+            plugins = lark_cython.plugins
+        _pattern_lark_parser = _build_pattern_lark_parser(plugins)
+    return _pattern_lark_parser
+
+
+def _build_pattern_lark_parser(plugins: Optional[dict] = None) -> Lark:
+    from lark import Lark
+    options = {'_plugins': plugins} if plugins is not None else {}
+    if _DISK_CACHE_PATH is not None:
+        # Only with the opt-in disk cache, and next to it: lark would otherwise pickle into the shared temp dir
+        options['cache'] = f"{_DISK_CACHE_PATH}.lark"
+    return Lark(_PATTERN_GRAMMAR, start='start', parser='lalr', lexer='contextual', maybe_placeholders=True, **options)
+
+
+def __getattr__(name: str):
+    # `pattern_lark_parser` used to be created at import time; keep it accessible
+    if name == 'pattern_lark_parser':
+        return get_pattern_lark_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class Lark2Pattern:
+    """
+    Turns a tree produced by `get_pattern_lark_parser()` into a `Pattern`.
+
+    Each rule is handled by the method of the same name, called with the already converted children.
+    The tree is walked directly instead of via `lark.Transformer`, whose per-node dispatch dominates for trees this small.
+    """
+    def transform(self, tree: Any) -> Any:
+        children = getattr(tree, 'children', None)
+        if children is None:
+            return tree  # Tokens and the `None` placeholders for missing optional parts
+        try:
+            handler = getattr(self, tree.data)
+        except AttributeError:
+            raise NotImplementedError((tree.data, tree.children)) from None
+        result = handler(*[self.transform(c) for c in children])
+        return _intern(result) if isinstance(result, Pattern) else result
     
     def value(self, *names):
-        return PtValue(tuple(v.value for v in names))
+        return _value(tuple(v.value for v in names))
 
     def none(self):
-        return PtLiteral(None)
+        return _NONE
 
     def true(self):
-        return PtLiteral(True)
+        return _TRUE
 
     def false(self):
-        return PtLiteral(False)
+        return _FALSE
 
     def number(self, t: Token):
-        return PtLiteral(eval(t.value))
+        s = t.value  # `common.NUMBER` is either plain digits or a float literal
+        return _literal(int(s) if s.isdigit() else float(s))
 
     def string(self, t: Token):
-        return PtLiteral(eval(t.value))
+        s = t.value
+        if '\\' not in s:
+            return _literal(s[1:-1])
+        return _literal(ast.literal_eval(s))
     
     def pos(self, *children: Pattern):
         return children
@@ -271,10 +635,10 @@ class Lark2Pattern(Transformer):
         return PtClass(cls, *(args or ((), ())))
     
     def capture(self, name: Token):
-        return PtCapture(name.value)
+        return _capture(name.value)
 
     def mapping(self, *elements):
-        return PtMapping(elements)
+        return PtMapping(elements, None)
 
     def mapping_star(self, *elements):
         return PtMapping(elements[:-1], elements[-1].value)
@@ -283,47 +647,108 @@ class Lark2Pattern(Transformer):
         return key, val
 
     def sequence(self, *children: Pattern):
-        if any(isinstance(c, str) for c in children):
-            pre = tuple(takewhile(lambda c: not isinstance(c, str), children))
-            star = children[len(pre)]
-            post = children[len(pre) + 1:]
-            assert not any(isinstance(c, str) for c in post)
-            return PtVariableSequence(pre, star, post)
-        else:
+        star_index = None
+        for i, c in enumerate(children):
+            if isinstance(c, str):
+                assert star_index is None, "Only one star pattern is allowed in a sequence"
+                star_index = i
+        if star_index is None:
             return PtFixedSequence(children)
+        return PtVariableSequence(children[:star_index], children[star_index], children[star_index + 1:])
 
     def star_pattern(self, n: Token):
         return n.value
     
     def or_pattern(self, *opt: Pattern):
-        return PtOr(opt)
+        # Flatten `(a | b) | c`, like `Ast2Pattern` does
+        return PtOr(tuple(o for p in opt for o in (p.options if isinstance(p, PtOr) else (p,))))
     
     def as_pattern(self, base, name: Token):
         return PtCaptureAs(base, name.value)
     
-    def start(self, pat, guard):
-        return pat, guard
+    def start(self, pat, guard: Optional[Token]):
+        return pat, (None if guard is None else guard.value)
+
+
+_lark2pattern = Lark2Pattern()
+
+
+# Opt-in cache of parsed patterns that is shared between processes. Helps short-lived programs,
+# since a program that only uses cached patterns doesn't need to import lark and build the parser at all.
+# Only point this at a file you trust, it is loaded with `pickle`.
+_DISK_CACHE_PATH = os.environ.get('PATTERN_MATCHING_CACHE')
+_DISK_CACHE_FORMAT = 1
+_DISK_CACHE_SIZE = 1024
+_disk_cache: Optional[dict[str, tuple[Pattern, Optional[str]]]] = None
+_disk_cache_dirty = False  # New patterns are only written out once, at exit
+
+
+def _get_disk_cache() -> dict[str, tuple[Pattern, Optional[str]]]:
+    global _disk_cache
+    if _disk_cache is None:
+        try:
+            with open(_DISK_CACHE_PATH, 'rb') as f:
+                version, _disk_cache = pickle.load(f)
+            if version != _DISK_CACHE_FORMAT:
+                _disk_cache = {}
+        except Exception:  # Missing, outdated or corrupt files are simply rebuilt
+            _disk_cache = {}
+        atexit.register(_save_disk_cache)
+    return _disk_cache
+
+
+def _save_disk_cache():
+    global _disk_cache_dirty
+    if not _disk_cache_dirty:
+        return
+    _disk_cache_dirty = False
+    tmp = f"{_DISK_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump((_DISK_CACHE_FORMAT, _disk_cache), f)
+        os.replace(tmp, _DISK_CACHE_PATH)  # Atomic, so that other processes never see a half written file
+    except OSError:
+        pass
 
 
 @lru_cache()
-def str2pattern(s: str) -> Pattern:
-    st = pattern_lark_parser.parse(s)
-    return Lark2Pattern().transform(st)
+def str2pattern(s: str) -> tuple[Pattern, Optional[str]]:
+    """
+    Parses `s` into a pattern and an optional guard expression.
+
+    The pattern can also be passed to `case` directly instead of the string,
+    which skips this lookup when matching in a hot loop.
+    """
+    global _disk_cache_dirty
+    if _DISK_CACHE_PATH is not None:
+        disk_cache = _get_disk_cache()
+        if s in disk_cache:
+            return disk_cache[s]
+    st = get_pattern_lark_parser().parse(s)
+    result = _lark2pattern.transform(st)
+    if _DISK_CACHE_PATH is not None and len(disk_cache) < _DISK_CACHE_SIZE:
+        disk_cache[s] = result
+        _disk_cache_dirty = True
+    return result
 
 
 class Ast2Pattern(ast.NodeVisitor):
+    def visit(self, node: ast.AST) -> Any:
+        result = super().visit(node)
+        return _intern(result) if isinstance(result, Pattern) else result
+
     def generic_visit(self, node: ast.AST):
         raise NotImplementedError(f"Unknown construct {node}")
 
     def visit_Call(self, node: ast.Call) -> Any:
         assert isinstance(node.func, ast.Name)
-        n = PtValue((node.func.id,))
+        n = _value((node.func.id,))
         args = tuple(self.visit(a) for a in node.args)
         kwargs = tuple((k.arg, self.visit(k.value)) for k in node.keywords)
         return PtClass(n, args, kwargs)
 
     def visit_Constant(self, node: ast.Constant) -> Any:
-        return PtLiteral(node.value)
+        return _literal(node.value)
 
     def visit_List(self, node: ast.List) -> Any:
         cur = pre = []
@@ -345,16 +770,16 @@ class Ast2Pattern(ast.NodeVisitor):
             return PtVariableSequence(tuple(pre), star, tuple(post))
 
     def visit_Name(self, node: ast.Name) -> Any:
-        return PtCapture(node.id) # yes, this includes `_`. I don't like the semantics distinctions
+        return _capture(node.id) # yes, this includes `_`. I don't like the semantics distinctions
     
     def visit_Attribute(self, node: ast.Attribute) -> Any:
         base = self.visit(node.value)
         attr = node.attr
         if isinstance(base, PtCapture):
-            return PtValue((base.name, attr))
+            return _value((base.name, attr))
         else:
             assert isinstance(base, PtValue)
-            return PtValue((*base.attributes, attr))
+            return _value((*base.attributes, attr))
     
     def visit_Dict(self, node: ast.Dict) -> Any:
         out = []
@@ -375,17 +800,21 @@ class Ast2Pattern(ast.NodeVisitor):
     
     def visit_BinOp(self, node: ast.BinOp) -> Any:
         if isinstance(node.op, ast.BitOr):
-            l,r = self.visit(node.left), self.visit(node.right)
-            opt = ()
-            if isinstance(l, PtOr):
-                opt = *opt, *l.options
-            else:
-                opt = *opt, l
-            if isinstance(r, PtOr):
-                opt = *opt, *r.options
-            else:
-                opt = *opt, r
-            return PtOr(opt)
+            # Walk the whole `a | b | c` chain at once instead of building a `PtOr` for every `|`
+            opt = []
+            stack = [node]
+            while stack:
+                n = stack.pop()
+                if isinstance(n, ast.BinOp) and isinstance(n.op, ast.BitOr):
+                    stack.append(n.right)
+                    stack.append(n.left)
+                else:
+                    v = self.visit(n)
+                    if isinstance(v, PtOr):
+                        opt.extend(v.options)
+                    else:
+                        opt.append(v)
+            return PtOr(tuple(opt))
         elif isinstance(node.op, ast.MatMult):
             assert isinstance(node.left, ast.Name) and node.left.id == "c"
             return self.visit(node.right)
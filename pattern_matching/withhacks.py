@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from types import FrameType
-from typing import Any, Callable, Optional, DefaultDict, Dict, ClassVar
+from functools import lru_cache
+from types import FrameType, CodeType
+from typing import Any, Callable, Optional, DefaultDict, Dict
 
 """
 
@@ -28,28 +29,37 @@ except ImportError:
     import dummy_threading as threading
 from collections import defaultdict
 
-_trace_lock = threading.Lock()
-_orig_sys_trace = None
+
+class _TracingState(threading.local):
+    """`sys.settrace` only affects the current thread, and frames only run on one thread,
+    so all bookkeeping is per thread as well. This also means no locking is needed."""
+
+    def __init__(self):
+        self.frame_tracers: Dict[FrameType, _FrameTracer] = {}
+        self.orig_sys_trace = None
+
+
+_tracing = _TracingState()
+
 
 def _dummy_sys_trace(*args, **kwds):
     """Dummy trace function used to enable tracing."""
 
 
 def _enable_tracing():
-    """Enable system-wide tracing, if it wasn't already."""
-    global _orig_sys_trace
+    """Enable tracing for the current thread, if it wasn't already."""
     try:
-        _orig_sys_trace = sys.gettrace()
+        _tracing.orig_sys_trace = sys.gettrace()
     except AttributeError:
-        _orig_sys_trace = None
-    if _orig_sys_trace is None:
+        _tracing.orig_sys_trace = None
+    if _tracing.orig_sys_trace is None:
         sys.settrace(_dummy_sys_trace)
 
 
 def _disable_tracing():
-    """Disable system-wide tracing, if we specifically switched it on."""
-    global _orig_sys_trace
-    if _orig_sys_trace is None:
+    """Disable tracing for the current thread, if we specifically switched it on."""
+    # Someone else (e.g. a debugger or coverage) might have installed their own hook in the meantime
+    if _tracing.orig_sys_trace is None and sys.gettrace() is _dummy_sys_trace:
         sys.settrace(None)
 
 @dataclass
@@ -59,43 +69,45 @@ class _FrameTracer:
     start_line: int
     injected_functions: DefaultDict[str, list] = field(default_factory=lambda: defaultdict(list))
     orig_trace_opcodes: bool = None
-    
-    trace_counter: ClassVar[int] = 0
+    left_start_line: bool = False
     
     def __call__(self, frame, event, arg):
         assert frame is self.frame
         if self.orig_function is not None:
             self.orig_function = self.orig_function(frame, event, arg)
-        if event == 'line' and frame.f_lineno == self.start_line:
-            # We want to to call the child functions at a point where assigning to `f_lineno` is valid.
-            # Sadly, sometimes python calls us to early for that when we are leaving a `__enter__` method (see bpo42286)
-            # Therefore we first check whether or not we are still on the line in which we were when inject_trace_func was called
-            # If we didn't move, we just don't do anything
-            return self
+        if event == 'line' and not self.left_start_line:
+            if frame.f_lineno == self.start_line:
+                # We want to to call the child functions at a point where assigning to `f_lineno` is valid.
+                # Sadly, sometimes python calls us to early for that when we are leaving a `__enter__` method (see bpo42286)
+                # Therefore we first check whether or not we are still on the line in which we were when inject_trace_func was called
+                # If we didn't move, we just don't do anything
+                return self
+            self.left_start_line = True  # Once we moved on, coming back to that line is a normal line event
+        functions = self.injected_functions.get(event)
+        if not functions:
+            return self  # Nothing to do for this event
         exc_to_reraise = None
-        for f in self.injected_functions[event]:
+        for f in functions:
             try:
                 f(frame)
             except Exception as e:
                 exc_to_reraise = e
-        with _trace_lock:
-            del self.injected_functions[event]
-            if event == 'opcode':
-                self.frame.f_trace_opcodes = self.orig_trace_opcodes
-            if len(self.injected_functions) > 0:
-                if exc_to_reraise is not None:
-                    raise exc_to_reraise
-                return self
-            _FrameTracer.trace_counter -= 1
-            assert _FrameTracer.trace_counter >= 0
-            del _frame_tracer[frame]
-            self.frame = None
-            if _FrameTracer.trace_counter == 0:
-                _disable_tracing()
-            frame.f_trace = self.orig_function
+        del self.injected_functions[event]
+        if event == 'opcode':
+            self.frame.f_trace_opcodes = self.orig_trace_opcodes
+        if len(self.injected_functions) > 0:
             if exc_to_reraise is not None:
                 raise exc_to_reraise
-            return self.orig_function
+            return self
+        frame_tracers = _tracing.frame_tracers
+        del frame_tracers[frame]
+        self.frame = None
+        if not frame_tracers:
+            _disable_tracing()
+        frame.f_trace = self.orig_function
+        if exc_to_reraise is not None:
+            raise exc_to_reraise
+        return self.orig_function
     
     def register_function(self, event: str, f: Callable):
         if event == 'opcode':
@@ -104,8 +116,6 @@ class _FrameTracer:
                 self.frame.f_trace_opcodes = True
         self.injected_functions[event].append(f)
 
-_frame_tracer: Dict[FrameType, _FrameTracer] = {}
-
 
 def inject_trace_func(frame, func, event='line'):
     """Inject the given function as a trace function for frame.
@@ -114,14 +124,17 @@ def inject_trace_func(frame, func, event='line'):
     resumes.  Since it's running inside a trace hook, it can do some nasty
     things like modify frame.f_locals, frame.f_lineno and friends.
     """
-    with _trace_lock:
-        if frame not in _frame_tracer:
-            if len(_frame_tracer) == 0:
-                _enable_tracing()
-            _frame_tracer[frame] = _FrameTracer(frame, frame.f_trace, frame.f_lineno)
-            frame.f_trace = _frame_tracer[frame]
-            _FrameTracer.trace_counter += 1
-        _frame_tracer[frame].register_function(event, func)
+    frame_tracers = _tracing.frame_tracers
+    enable = not frame_tracers
+    tracer = frame_tracers.get(frame)
+    if tracer is None:
+        tracer = frame_tracers[frame] = _FrameTracer(frame, frame.f_trace, frame.f_lineno)
+        frame.f_trace = tracer
+    tracer.register_function(event, func)
+    if enable:
+        # Only after `register_function`: since 3.12 `sys.settrace` only turns on opcode events
+        # if `f_trace_opcodes` was already set on some frame
+        _enable_tracing()
 
 
 # def _invoke_trace_funcs(frame, event, arg):
@@ -155,6 +168,9 @@ def inject_trace_func(frame, func, event='line'):
 #                 return frame.f_trace(frame, event, arg)
 
 
+_missing = object()
+
+
 def lookup_name(frame, name):
     """Get the value of the named variable, as seen by the given frame.
 
@@ -162,16 +178,106 @@ def lookup_name(frame, name):
     f_builtins.  If it's not defined in any of these scopes, NameError 
     is raised.
     """
-    try:
-        return frame.f_locals[name]
-    except KeyError:
+    # `.get` instead of try/except: names are usually globals, and raising two KeyErrors per lookup adds up
+    value = frame.f_locals.get(name, _missing)
+    if value is _missing:
+        value = frame.f_globals.get(name, _missing)
+        if value is _missing:
+            value = frame.f_builtins.get(name, _missing)
+            if value is _missing:
+                raise NameError(name)
+    return value
+
+
+# `PyFrame_LocalsToFast`, looked up on first use so that only code injecting variables imports ctypes.
+# `None` if f_locals writes through anyway (PEP 667), `False` if it isn't available (no ctypes, or not CPython)
+_locals_to_fast = _missing
+
+
+def _load_locals_to_fast():
+    global _locals_to_fast
+    if sys.version_info >= (3, 13):
+        _locals_to_fast = None
+    else:
         try:
-            return frame.f_globals[name]
-        except KeyError:
-            try:
-                return frame.f_builtins[name]
-            except KeyError:
+            import ctypes
+            f = ctypes.pythonapi.PyFrame_LocalsToFast
+            f.argtypes = [ctypes.py_object, ctypes.c_int]
+            f.restype = None
+        except (ImportError, AttributeError):
+            f = False
+        _locals_to_fast = f
+    return _locals_to_fast
+
+
+def set_fast_locals(frame, values: dict[str, Any]) -> bool:
+    """Writes `values` into the local variables of the given (function) frame, right now.
+
+    Returns False if this isn't supported by the interpreter, in which case `inject_trace_func` has to be used.
+    Unlike that, this doesn't need to turn on tracing, which slows down everything running in the meantime.
+    """
+    locals_to_fast = _locals_to_fast
+    if locals_to_fast is _missing:
+        locals_to_fast = _load_locals_to_fast()
+    if locals_to_fast is None:
+        f_locals = frame.f_locals
+        for n, v in values.items():
+            f_locals[n] = v
+    elif locals_to_fast:
+        frame.f_locals.update(values)
+        locals_to_fast(frame, 0)
+    else:
+        return False
+    return True
+
+
+def frame_scopes(frame, fresh_locals: bool = True) -> Optional[tuple[dict[str, Any], ...]]:
+    """Returns the scopes `name_resolver` should search for `frame`, if they can be reused across calls.
+
+    In module scope f_locals is f_globals, so the dicts stay valid for as long as the frame runs.
+    In function scope f_locals is a snapshot, so `None` is returned (meaning: fetch them again)
+    unless `fresh_locals` is false.
+    """
+    f_locals = frame.f_locals
+    if f_locals is frame.f_globals:
+        return f_locals, frame.f_builtins
+    elif not fresh_locals:
+        return f_locals, frame.f_globals, frame.f_builtins
+    else:
+        return None
+
+
+def name_resolver(frame, scopes: Optional[tuple[dict[str, Any], ...]] = None) -> Callable[[str], Any]:
+    """Returns a function that works like `lookup_name(frame, name)`, for resolving multiple names at once.
+
+    Each name is only looked up once, and f_locals (which CPython rebuilds on every access)
+    is only materialized once, and only if a name is actually requested.
+    `scopes` can be the cached result of `frame_scopes(frame)`.
+    Only use the result while the frame's variables can't change.
+    """
+    resolved = {}
+
+    def get(name):
+        nonlocal scopes
+        value = resolved.get(name, _missing)
+        if value is _missing:
+            if scopes is None:
+                scopes = (frame.f_locals, frame.f_globals, frame.f_builtins)
+            for scope in scopes:
+                value = scope.get(name, _missing)
+                if value is not _missing:
+                    break
+            else:
                 raise NameError(name)
+            resolved[name] = value
+        return value
+    return get
+
+
+@lru_cache(maxsize=1024)
+def _local_names(code: CodeType) -> frozenset[str]:
+    """The names the compiler treats as local variables of `code`, cached since every with-block needs them."""
+    return frozenset(code.co_varnames)
 
 
 class _ExitContext(Exception):
@@ -228,20 +334,19 @@ class WithHack(object):
         
         f = self.__frame__
         if f.f_locals is f.f_globals: # we are in global scope. We don't need to worry and the old approach works
-            inject_trace_func(f, lambda frame: frame.f_locals.update(locals), 'opcode')
+            f.f_globals.update(locals)
         else:
-            c = f.f_code
-            lcl_vars = set(c.co_varnames)
-            store_local = set(locals.keys()) & lcl_vars
-            store_global = set(locals.keys()) - store_local
-            self.__to_reset__ |= {n:f.f_globals.get(n, self._missing_marker) for n in store_global}
-            def set_vars(frame):
-                for n,v in locals.items():
-                    if n in store_local:
-                        frame.f_locals[n] = v
-                    else:
-                        frame.f_globals[n] = v
-            inject_trace_func(f, set_vars, 'opcode')
+            lcl_vars = _local_names(f.f_code)
+            store_local = {}
+            for n, v in locals.items():
+                if n in lcl_vars:
+                    store_local[n] = v
+                else:
+                    # Only the value from before the first injection has to be restored
+                    self.__to_reset__.setdefault(n, f.f_globals.get(n, self._missing_marker))
+                    f.f_globals[n] = v
+            if store_local and not set_fast_locals(f, store_local):
+                inject_trace_func(f, lambda frame: frame.f_locals.update(store_local), 'opcode')
     
     def _set_lineno(self, i: int):
         """Sets the next line to be executed"""
@@ -265,7 +370,9 @@ class WithHack(object):
         Be sure to call the superclass version if you override it.
         """
         f = sys._getframe(1)
-        while f.f_locals.get("self") is self:  # We need to adjust for super calls
+        # We need to adjust for super calls. Only frames of methods can have `self` as their first argument,
+        # checking that first avoids building f_locals for the user's frame
+        while f.f_code.co_varnames[:1] == ('self',) and f.f_locals.get("self") is self:
             f = f.f_back
         self.__frame__ = f
         return self
@@ -281,15 +388,14 @@ class WithHack(object):
         value given by this base implementation.
         """
         # register_opcode_debugger(self.__frame__)
-        for n, v in self.__to_reset__.copy().items():
-            if v is self._missing_marker:
-                try:
-                    del self.__frame__.f_globals[n]
-                except KeyError:
-                    pass
-            else:
-                self.__frame__.f_globals[n] = v
-            del self.__to_reset__[n]
+        if self.__to_reset__:
+            f_globals = self.__frame__.f_globals
+            for n, v in self.__to_reset__.items():
+                if v is self._missing_marker:
+                    f_globals.pop(n, None)
+                else:
+                    f_globals[n] = v
+            self.__to_reset__.clear()
         self.__frame__ = None
         if exc_type is _ExitContext:
             return True
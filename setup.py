@@ -50,6 +50,7 @@ setup(
 
     python_requires='>=3.7',
     install_requires=['lark'],
+    extras_require={'cython': ['lark-cython']},
     project_urls={  # Optional
         'Bug Reports': 'https://github.com/MegaIng/pattern-matching/issues',
         'Source': 'https://github.com/MegaIng/pattern-matching/',
@@ -2,10 +2,11 @@ from __future__ import annotations
 
 import unittest
 
-from tests.test_injecting import TestInjecting
+from tests.test_injecting import TestInjecting, TestTraceInjection
 from tests.test_no_magic import TestNoMagic
 from tests.test_auto_lookup import TestAutoLookup
 from tests.test_full_magic import TestFullMagicGenerated
+from tests.test_pattern_engine import TestLarkParser, TestDiskCache, TestTypeCaches, TestOrPatterns
 
 
 if __name__ == '__main__':
@@ -3,11 +3,14 @@ from __future__ import annotations
 import re
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any
 
 from lark import v_args
 from lark.visitors import Transformer
 
+from pattern_matching.pattern_engine import get_pattern_lark_parser
+
 
 @dataclass(frozen=True)
 class Example:
@@ -233,6 +236,18 @@ Invalid action {'sound': 'hello_world.ogg'}
 Unsupported audio format
 """)
 
+TEST_MAPPING_STAR = Example('TEST_MAPPING_STAR', """
+for config in ({"host": "localhost", "port": 80, "debug": True}, {"port": 80}):
+    match config:
+        case {"host": host, **rest}:
+            print("Connecting to", $host, "with", $rest)
+        case _:
+            print("No host in", config)
+""", """\
+Connecting to localhost with {'port': 80, 'debug': True}
+No host in {'port': 80}
+""")
+
 TEST_BUILTINS = Example('TEST_BUILTINS', """
 actions = [
     {"text": "Hello World", "color": "blue"},
@@ -304,6 +319,125 @@ classify(8)
 2 3 4
 """)
 
+TEST_OR_LENGTHS = Example('TEST_OR_LENGTHS', """
+def do(command):
+    match command:
+        case ["stop"] | ["halt", "now"] | [_, _, "stop"]:
+            print("Stopping")
+        case [verb] | [verb, "it"] | (verb, "it", "now"):
+            print("Doing", $verb)
+        case ["say", *words] | [words, "said"] | [words, "was", "said"]:
+            print("Saying", $words)
+        case [key, value] | [key, "=", value] | {"key": key, "value": value}:
+            print("Setting", $key, "to", $value)
+        case _:
+            print("Unknown command", command)
+
+do(["stop"])
+do(["halt", "now"])
+do(["halt"])
+do(("jump", "it", "now"))
+do(["jump", "it"])
+do(["say", "said"])
+do(["hello", "said"])
+do(["hi", "was", "said"])
+do(["say", "a", "b", "c"])
+do(["x", 1])
+do(["z", "=", 3])
+do({"key": "y", "value": 2})
+do(["a", "b", "c", "d", "e"])
+do([])
+do(5)
+""", """\
+Stopping
+Stopping
+Doing halt
+Doing jump
+Doing jump
+Saying ['said']
+Saying hello
+Saying hi
+Saying ['a', 'b', 'c']
+Setting x to 1
+Setting z to 3
+Setting y to 2
+Unknown command ['a', 'b', 'c', 'd', 'e']
+Unknown command []
+Unknown command 5
+""")
+
+TEST_OR_SAME_CLASS = Example('TEST_OR_SAME_CLASS', """
+class Shape:
+    __match_args__ = ("kind", "size")
+
+    def __init__(self, kind, size):
+        self.kind = kind
+        self.size = size
+
+class Ring(Shape):
+    pass
+
+def describe(s):
+    match s:
+        case Shape(k, 0) | Shape("disc", k):
+            print("flat", $k)
+        case Shape("circle", r) | Shape("ring", r):
+            print("round", $r)
+        case Shape(kind="square") | Shape(kind="rectangle"):
+            print("angular")
+        case _:
+            print("unknown")
+
+describe(Shape("square", 0))
+describe(Shape("disc", 5))
+describe(Shape("circle", 2))
+describe(Ring("ring", 3))
+describe(Shape("rectangle", 4))
+describe(Shape("cube", 1))
+describe(("circle", 2))
+""", """\
+flat square
+flat 5
+round 2
+round 3
+angular
+unknown
+unknown
+""", ('Shape',))
+
+TEST_MANY_LITERALS = Example('TEST_MANY_LITERALS', """
+class Two:
+    def __eq__(self, other):
+        return other == 2
+
+def describe(x):
+    match x:
+        case 1 | True | 1.0 | "one" | "uno":
+            return "one"
+        case None | 2 | "two" | 2.5 | "zwei":
+            return "two-ish"
+        case _:
+            return "other"
+
+for v in [1, True, 1.0, 1+0j, "one", "uno", None, 2.0, 2.5, "zwei", Two(), "2", 3, [1]]:
+    print(describe(v))
+""", """\
+one
+one
+one
+one
+one
+one
+two-ish
+two-ish
+two-ish
+two-ish
+two-ish
+other
+other
+other
+""")
+
 TEST_DATACLASS = Example('TEST_DATACLASS', """
 from dataclasses import dataclass
 from typing import Union
@@ -437,6 +571,12 @@ _CASE_PATTERN  = re.compile("    case (.*):")
 _BOUND_ACCESS_PATTERN = re.compile("\$(\w+)")
     
 
+@lru_cache(maxsize=None)
+def parse_case(pattern: str):
+    """Parses the pattern (and guard) of a `case`. The same ones show up in every translator, so they are shared."""
+    return get_pattern_lark_parser().parse(pattern)
+
+
 class ExampleTranslator(ABC):
     @abstractmethod
     def match(self, expr: str, used_names: tuple[str, ...]) -> str:
@@ -461,7 +601,6 @@ class ExampleTranslator(ABC):
             return r
         code = _CASE_PATTERN.sub(_case, code)
         code = _BOUND_ACCESS_PATTERN.sub(lambda m: self.bound_access(m.group(1)), code)
-        assert compile(code, "<example>", 'exec') is not None
         return code
     
     def run_example(self, e: Example, glbs: dict[str, Any]) -> str:
@@ -470,7 +609,8 @@ class ExampleTranslator(ABC):
         def fake_print(*args, sep=" ", end="\n"):
             out.append(sep.join(map(str, args)) + end)
         try:
-            exec(code, {**glbs, 'print': fake_print})
+            # Compiled here instead of in `translate`, so that the code is only compiled once
+            exec(compile(code, "<example>", 'exec'), {**glbs, 'print': fake_print})
         except Exception:
             print(f"--- Generated code for failing example {e.name} (with {self.__class__.__name__}) ---", flush=True)
             print(code)
@@ -487,18 +627,27 @@ class Rebuild(Transformer):
         return t.value
     
     number = capture = string = _unchanged
-    
+
+    def none(self):
+        return "None"
+
+    def true(self):
+        return "True"
+
+    def false(self):
+        return "False"
+
     def value(self, *a):
-        return '.'.join(a)
+        return '.'.join(t.value for t in a)
     
     def star_pattern(self, n):
-        return f"*{n}"
+        return f"*{n.value}"
     
     def sequence(self, *c):
         return '['+ ', '.join(c) + ']'
     
     def keyw(self, n, v):
-        return f"{n}={v}"
+        return f"{n.value}={v}"
     
     def keyws(self, *a):
         return ', '.join(a)
@@ -525,6 +674,9 @@ class Rebuild(Transformer):
 
     def mapping(self, *c):
         return '{'+ ', '.join(c) + '}'
+
+    def mapping_star(self, *c):
+        return '{'+ ', '.join((*c[:-1], f"**{c[-1]}")) + '}'
     
     def as_pattern(self, base, name):
         return f"{base} as {name}"
@@ -1,12 +1,12 @@
 from __future__ import annotations
 
+import copy
 import unittest
 from unittest import TestCase
 
 from lark import v_args
 
-from pattern_matching.pattern_engine import pattern_lark_parser
-from tests.examples import EXAMPLES, ExampleTranslator, Rebuild
+from tests.examples import EXAMPLES, ExampleTranslator, Rebuild, parse_case
 from pattern_matching.auto_lookup import match
 
 
@@ -27,7 +27,7 @@ class _AutoLookupTranslator(ExampleTranslator):
         return f"with match({expr}) as m:\n"
 
     def case(self, pattern: str, is_first_case: bool) -> str:
-        p = _to_auto_lookup.transform(pattern_lark_parser.parse(pattern))
+        p = _to_auto_lookup.transform(parse_case(pattern))
         if is_first_case:
             return f"    if {p}:\n"
         else:
@@ -41,8 +41,29 @@ auto_lookup = _AutoLookupTranslator()
 class TestAutoLookup(TestCase):
     def test_examples(self):
         for n, v in EXAMPLES.items():
-            output = auto_lookup.run_example(v, {'match': match})
-            self.assertEqual(v.output,output, msg=n)
+            with self.subTest(example=n):
+                output = auto_lookup.run_example(v, {'match': match})
+                self.assertEqual(v.output,output, msg=n)
+
+    def test_match_object_attributes(self):
+        with match([1, 2]) as m:
+            self.assertIsNone(getattr(m, 'x', None))
+            self.assertTrue(m.case('[x, y]'))
+            self.assertIsNone(getattr(m, 'missing', None))
+            c = copy.copy(m)
+        for c in (c, copy.copy(m), copy.deepcopy(m)):
+            self.assertEqual((c.x, c.y), (1, 2))
+            self.assertIsNone(getattr(c, 'missing', None))
+
+    def test_case_outside_of_block(self):
+        m = match([1, 2])
+        with self.assertRaisesRegex(ValueError, "only valid inside"):
+            m.case('[x, y]')
+        with m:
+            self.assertTrue(m.case('list([x, y])'))
+        with self.assertRaisesRegex(ValueError, "only valid inside"):
+            m.case('list([x, y])')
+        self.assertEqual((m.x, m.y), (1, 2))
 
 
 if __name__ == '__main__':
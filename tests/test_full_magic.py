@@ -7,9 +7,8 @@ from textwrap import indent
 from lark import v_args
 from lark.visitors import Transformer
 
-from tests.examples import EXAMPLES, ExampleTranslator, Rebuild
+from tests.examples import EXAMPLES, ExampleTranslator, Rebuild, parse_case
 from pattern_matching.full_magic import match
-from pattern_matching.pattern_engine import pattern_lark_parser
 
 
 @v_args(inline=True)
@@ -30,7 +29,7 @@ class _FullMagicTranslator(ExampleTranslator):
         return f"with match({expr}):\n"
     
     def case(self, pattern: str, is_first_case: bool) -> str:
-        pattern = pep634_to_py.transform(pattern_lark_parser.parse(pattern))
+        pattern = pep634_to_py.transform(parse_case(pattern))
         if is_first_case:
             return f"    if c@ {pattern}:\n"
         else:
@@ -45,8 +44,7 @@ GENERATED_MODULE_NAME = 'generated_test_full_magic'
 GENERATED_FILE_NAME = Path(__file__).with_name(GENERATED_MODULE_NAME + '.py')
 
 def _generate_tests():
-    with open(GENERATED_FILE_NAME, 'w') as f:
-        f.write('''\
+    parts = ['''\
 """ Auto generated """
 from pattern_matching.full_magic import match
 from unittest import TestCase
@@ -60,13 +58,23 @@ class TestFullMagicGenerated(TestCase):
         with redirect_stdout(buf):
             yield
         self.assertMultiLineEqual(expected, buf.getvalue())
-''')
-        for n, e in EXAMPLES.items():
-            f.write(f'''
+''']
+    for n, e in EXAMPLES.items():
+        parts.append(f'''
     def {n.lower()}(self):\n
         with self.assertOutputs({e.output!r}):
 {indent(full_magic.translate(e), ' ' * 12)}
 ''')
+    source = ''.join(parts)
+    # Only write if something changed, so that the cached bytecode of the generated module stays valid
+    try:
+        with open(GENERATED_FILE_NAME) as f:
+            if f.read() == source:
+                return
+    except FileNotFoundError:
+        pass
+    with open(GENERATED_FILE_NAME, 'w') as f:
+        f.write(source)
 
 _generate_tests()
 TestFullMagicGenerated = getattr(__import__('tests.' + GENERATED_MODULE_NAME), GENERATED_MODULE_NAME).TestFullMagicGenerated
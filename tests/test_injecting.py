@@ -1,13 +1,15 @@
 from __future__ import annotations
 
+import sys
+import threading
 import unittest
 from unittest import TestCase
 
 from lark import v_args
 
-from pattern_matching.pattern_engine import pattern_lark_parser
-from tests.examples import EXAMPLES, ExampleTranslator, Rebuild
+from tests.examples import EXAMPLES, ExampleTranslator, Rebuild, parse_case
 from pattern_matching.injecting import match, case
+from pattern_matching.withhacks import inject_trace_func
 
 @v_args(inline=True)
 class PEP634_To_Injecting(Rebuild):
@@ -24,7 +26,7 @@ class _InjectingTranslatorWithM(ExampleTranslator):
         return f"with match({expr}) as m:\n"
     
     def case(self, pattern: str, is_first_case: bool) -> str:
-        p = _to_injecting.transform(pattern_lark_parser.parse(pattern))
+        p = _to_injecting.transform(parse_case(pattern))
         if is_first_case:
             return f"    if m.{p}:\n"
         else:
@@ -40,7 +42,7 @@ class _InjectingTranslatorWithoutM(ExampleTranslator):
         return f"with match({expr}):\n"
     
     def case(self, pattern: str, is_first_case: bool) -> str:
-        p = _to_injecting.transform(pattern_lark_parser.parse(pattern))
+        p = _to_injecting.transform(parse_case(pattern))
         if is_first_case:
             return f"    if {p}:\n"
         else:
@@ -54,13 +56,46 @@ injecting_without_m = _InjectingTranslatorWithoutM()
 class TestInjecting(TestCase):
     def test_examples_with_m(self):
         for n, v in EXAMPLES.items():
-            output = injecting_with_m.run_example(v, {'match': match})
-            self.assertEqual(v.output,output, msg=n)
+            with self.subTest(example=n):
+                output = injecting_with_m.run_example(v, {'match': match})
+                self.assertEqual(v.output,output, msg=n)
 
     def test_examples_without_m(self):
         for n, v in EXAMPLES.items():
-            output = injecting_without_m.run_example(v, {'match': match, 'case': case})
-            self.assertEqual(v.output,output, msg=n)
+            with self.subTest(example=n):
+                output = injecting_without_m.run_example(v, {'match': match, 'case': case})
+                self.assertEqual(v.output,output, msg=n)
+
+
+class TestTraceInjection(TestCase):
+    @staticmethod
+    def bind(i, event):
+        def set_x(frame):
+            frame.f_locals['x'] = i
+        x = None
+        inject_trace_func(sys._getframe(), set_x, event)
+        return x
+
+    def test_opcode(self):
+        for i in range(3):
+            self.assertEqual(self.bind(i, 'opcode'), i)
+
+    def test_threads(self):
+        # The registered trace functions are per thread, so that threads don't run (or remove) each other's
+        errors = []
+        def run():
+            try:
+                for i in range(3000):
+                    self.assertEqual(self.bind(i, 'line'), i)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
 
 
 if __name__ == '__main__':
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import copy
 import unittest
 from unittest import TestCase
 
 from lark import v_args
 
-from pattern_matching.pattern_engine import pattern_lark_parser
-from tests.examples import EXAMPLES, ExampleTranslator, Rebuild
+from pattern_matching.pattern_engine import str2pattern
+from tests.examples import EXAMPLES, ExampleTranslator, Rebuild, parse_case
 
 from pattern_matching import Matcher
 
@@ -20,12 +21,23 @@ class PEP634_To_NoMagic(Rebuild):
 
 _to_no_magic = PEP634_To_NoMagic()
 
+
+@v_args(inline=True)
+class PEP634_To_NoMagicParsed(Rebuild):
+    def start(self, pat, guard):
+        if guard is not None:
+            return f"m.case(str2pattern({pat!r})[0]) and {guard}"
+        else:
+            return f"m.case(str2pattern({pat!r})[0])"
+
+_to_no_magic_parsed = PEP634_To_NoMagicParsed()
+
 class _NoMagicTranslator(ExampleTranslator):
     def match(self, expr: str, used_names: tuple[str, ...]) -> str:
         return f"with Matcher({', '.join(used_names)})({expr}) as m:\n"
 
     def case(self, pattern: str, is_first_case: bool) -> str:
-        p = _to_no_magic.transform(pattern_lark_parser.parse(pattern))
+        p = _to_no_magic.transform(parse_case(pattern))
         if is_first_case:
             return f"    if {p}:\n"
         else:
@@ -37,11 +49,81 @@ class _NoMagicTranslator(ExampleTranslator):
 no_magic = _NoMagicTranslator()
 
 
+class _NoMagicMemoTranslator(_NoMagicTranslator):
+    def match(self, expr: str, used_names: tuple[str, ...]) -> str:
+        return f"with Matcher({', '.join(used_names)})({expr}, memo=True) as m:\n"
+
+no_magic_memo = _NoMagicMemoTranslator()
+
+
+class _NoMagicParsedTranslator(_NoMagicTranslator):
+    def case(self, pattern: str, is_first_case: bool) -> str:
+        p = _to_no_magic_parsed.transform(parse_case(pattern))
+        if is_first_case:
+            return f"    if {p}:\n"
+        else:
+            return f"    elif {p}:\n"
+
+no_magic_parsed = _NoMagicParsedTranslator()
+
+
 class TestNoMagic(TestCase):
     def test_examples(self):
         for n, v in EXAMPLES.items():
-            output = no_magic.run_example(v, {'Matcher': Matcher})
-            self.assertEqual(v.output,output, msg=n)
-            
+            with self.subTest(example=n):
+                output = no_magic.run_example(v, {'Matcher': Matcher})
+                self.assertEqual(v.output,output, msg=n)
+
+    def test_examples_memo(self):
+        for n, v in EXAMPLES.items():
+            with self.subTest(example=n):
+                output = no_magic_memo.run_example(v, {'Matcher': Matcher})
+                self.assertEqual(v.output,output, msg=n)
+
+    def test_examples_parsed(self):
+        for n, v in EXAMPLES.items():
+            with self.subTest(example=n):
+                output = no_magic_parsed.run_example(v, {'Matcher': Matcher, 'str2pattern': str2pattern})
+                self.assertEqual(v.output,output, msg=n)
+
+    def test_memo_keeps_equal_literals_apart(self):
+        class OnlyInt:
+            def __eq__(self, other):
+                return type(other) is int and other == 1
+
+        for memo in (False, True):
+            with self.subTest(memo=memo):
+                m = Matcher()(OnlyInt(), memo=memo)
+                self.assertTrue(m.case('1'))
+                self.assertFalse(m.case('True'))
+                self.assertFalse(m.case('1.0'))
+                self.assertTrue(m.case('1'))
+
+    def test_match_many(self):
+        values = [1, 2.5, [1, 2], [3, 4, 5], {'x': [2, 'b']}, None, []]
+        names = {'int': int, 'float': float, 'str': str, 'list': list}
+        n = None
+        for pattern, expected in [
+            ('1 | 2.5', [{}, {}, n, n, n, n, n]),
+            ('int(x) | float(x)', [{'x': 1}, {'x': 2.5}, n, n, n, n, n]),
+            ('[x, *rest]', [n, n, {'x': 1, 'rest': [2]}, {'x': 3, 'rest': [4, 5]}, n, n, n]),
+            ('{"x": [y, str(s)]}', [n, n, n, n, {'y': 2, 's': 'b'}, n, n]),
+            ('list() as l', [n, n, {'l': [1, 2]}, {'l': [3, 4, 5]}, n, n, {'l': []}]),
+        ]:
+            with self.subTest(pattern=pattern):
+                pt, _ = str2pattern(pattern)
+                self.assertEqual(pt.match_many(values, names.__getitem__), expected)
+                self.assertEqual(pt.match_many(iter(values), names.__getitem__), expected)
+                self.assertEqual([pt.match(v, names.__getitem__) for v in values], expected)
+
+    def test_match_object_attributes(self):
+        m = Matcher()([1, 2])
+        self.assertIsNone(getattr(m, 'x', None))
+        self.assertTrue(m.case('[x, y]'))
+        self.assertIsNone(getattr(m, 'missing', None))
+        for c in (copy.copy(m), copy.deepcopy(m)):
+            self.assertEqual((c.x, c.y), (1, 2))
+            self.assertIsNone(getattr(c, 'missing', None))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
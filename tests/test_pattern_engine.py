@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import gc
+import os
+import pickle
+import tempfile
+import unittest
+import weakref
+from collections.abc import Sequence
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+from pattern_matching import match_args_data, pattern_engine
+from pattern_matching.pattern_engine import Lark2Pattern, _build_pattern_lark_parser, str2pattern
+from tests.examples import EXAMPLES, _CASE_PATTERN
+
+try:
+    import lark_cython
+except ImportError:
+    lark_cython = None
+
+CASE_PATTERNS = sorted({p for e in EXAMPLES.values() for p in _CASE_PATTERN.findall(e.code)})
+
+
+class TestLarkParser(TestCase):
+    @unittest.skipIf(lark_cython is None, "lark_cython is not installed")
+    def test_lark_cython_parses_the_same(self):
+        plain, cython = _build_pattern_lark_parser(), _build_pattern_lark_parser(lark_cython.plugins)
+        for p in CASE_PATTERNS:
+            with self.subTest(pattern=p):
+                self.assertEqual(Lark2Pattern().transform(plain.parse(p)), Lark2Pattern().transform(cython.parse(p)))
+
+    def test_grammar_cache_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as d:
+            with patch.object(pattern_engine, '_DISK_CACHE_PATH', None), patch.object(tempfile, 'tempdir', d):
+                _build_pattern_lark_parser()
+                self.assertEqual(os.listdir(d), [])
+            path = os.path.join(d, 'patterns.cache')
+            with patch.object(pattern_engine, '_DISK_CACHE_PATH', path):
+                _build_pattern_lark_parser()
+                self.assertEqual(os.listdir(d), ['patterns.cache.lark'])
+                _build_pattern_lark_parser()  # Loaded from the file this time
+
+
+
+class TestDiskCache(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'patterns.cache')
+        self._patch = patch.multiple(pattern_engine, _DISK_CACHE_PATH=self.path, _disk_cache=None, _disk_cache_dirty=False)
+        self._patch.start()
+
+    def tearDown(self):
+        self._patch.stop()
+        self._dir.cleanup()
+
+    def parse(self, s: str):
+        return str2pattern.__wrapped__(s)  # Without the in-memory cache in front of it
+
+    def reload(self):
+        pattern_engine._disk_cache = None
+        return pattern_engine._get_disk_cache()
+
+    def write(self, data: bytes):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_save_and_load(self):
+        result = self.parse('Point(x, 0) if x > 1')
+        self.assertFalse(os.path.exists(self.path))  # Only written when saving, not for every new pattern
+        self.parse('[a, *b]')
+        pattern_engine._save_disk_cache()
+        self.assertEqual(self.reload(), {'Point(x, 0) if x > 1': result, '[a, *b]': self.parse('[a, *b]')})
+        with patch.object(pattern_engine, 'get_pattern_lark_parser', side_effect=AssertionError("parsed again")):
+            self.assertEqual(self.parse('Point(x, 0) if x > 1'), result)
+
+    def test_save_only_when_changed(self):
+        pattern_engine._save_disk_cache()
+        self.assertFalse(os.path.exists(self.path))
+        self.parse('1 | 2')
+        pattern_engine._save_disk_cache()
+        mtime = os.stat(self.path).st_mtime_ns
+        self.parse('1 | 2')
+        pattern_engine._save_disk_cache()
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_other_format_is_ignored(self):
+        self.write(pickle.dumps((pattern_engine._DISK_CACHE_FORMAT + 1, {'1': 'not a pattern'})))
+        self.assertEqual(self.reload(), {})
+        self.assertEqual(self.parse('1'), (pattern_engine._literal(1), None))
+
+    def test_corrupt_file_is_rebuilt(self):
+        self.write(b'definitely not a pickle')
+        self.assertEqual(self.reload(), {})
+        result = self.parse('[x]')
+        pattern_engine._save_disk_cache()
+        self.assertEqual(self.reload(), {'[x]': result})
+
+
+class TestTypeCaches(TestCase):
+    def test_matched_classes_are_not_kept_alive(self):
+        class Point:
+            __match_args__ = ('x', 'y')
+
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+        get = {'Point': Point}.__getitem__
+        self.assertEqual(str2pattern('Point(x, y)')[0].match(Point(1, 2), get), {'x': 1, 'y': 2})
+        self.assertEqual(str2pattern('Point(y=0)')[0].match(Point(1, 0), get), {})
+        ref = weakref.ref(Point)
+        del Point, get
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_type_check_cache_is_bounded(self):
+        cache = pattern_engine._TypeCheckCache(Sequence, maxsize=4)
+        types = [type(f'T{i}', (list if i % 2 else object,), {}) for i in range(10)]
+        for t in types:
+            self.assertEqual(cache[t], issubclass(t, Sequence))
+            self.assertLessEqual(len(cache), 4)
+        self.assertIn(types[-1], cache)
+
+
+
+class TestOrPatterns(TestCase):
+    def test_shared_class(self):
+        class Shape:
+            __match_args__ = ('kind', 'size')
+
+            def __init__(self, kind, size):
+                self.kind = kind
+                self.size = size
+
+        names = {'shapes': SimpleNamespace(Shape=Shape), 'f': len}
+        looked_up = []
+        def get(name):
+            looked_up.append(name)
+            return names[name]
+
+        pt, _ = str2pattern('shapes.Shape("circle", r) | shapes.Shape("disc", r)')
+        self.assertEqual(pt.match(Shape("disc", 2), get), {'r': 2})
+        self.assertEqual(looked_up, ['shapes'])  # Resolved once, not again by each option
+        self.assertIsNone(pt.match(("disc", 2), get))
+        # A name that isn't a class fails the same way as in a single class pattern
+        for pattern in ('f(1)', 'f(1) | f(2)'):
+            with self.subTest(pattern=pattern), self.assertRaises(AssertionError):
+                str2pattern(pattern)[0].match(1, get)
+
+
+if __name__ == '__main__':
+    unittest.main()